@@ -1,9 +1,21 @@
+from __future__ import annotations
+
 import streamlit as st
 import sqlite3
-import pandas as pd
 from datetime import datetime, date
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional, Iterator, TYPE_CHECKING
+from contextlib import contextmanager
+from functools import partial
 import io
+import csv
+import threading
+import time
+from math import fsum
+
+# pandas and numpy are imported lazily inside the functions that need them
+# (~200ms and ~50ms of cold start)
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Database file path
 DB_FILE = "data.db"
@@ -20,16 +32,136 @@ SCENARIOS = {
 
 # Firm percentage (taken from total before partner distribution)
 FIRM_PERCENTAGE = 3
+FIRM_FRAC = FIRM_PERCENTAGE / 100
 
 # Currency symbol
 CURRENCY = "zł"
 
+# Size of the per-connection prepared statement cache
+CACHED_STATEMENTS = 128
+
+# Minimum interval between PRAGMA optimize runs (seconds)
+OPTIMIZE_INTERVAL_SECONDS = 15 * 60
+
+# Bump whenever _create_schema changes so existing databases pick it up
+SCHEMA_VERSION = 2
+
+# Oldest SQLite with generated columns (3.31) and PRAGMA table_xinfo (3.26)
+MIN_SQLITE_VERSION = (3, 31, 0)
+
+# Rows fetched per batch when streaming exports to CSV
+CSV_BATCH_SIZE = 1000
+
+# Local ISO-8601 timestamp computed by SQLite with millisecond precision (SS.SSS);
+# datetime.isoformat() used microseconds, so same-millisecond writes now tie
+NOW_SQL = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
 
+# Hot queries kept as constants so repeated calls hit the statement cache
+UPSERT_WORKLOG_SQL = f"""
+    INSERT INTO worklog (project_id, date, partner, present, logged_at)
+    VALUES (?, ?, ?, ?, {NOW_SQL})
+    ON CONFLICT(project_id, date, partner) DO UPDATE SET
+        present = excluded.present,
+        logged_at = excluded.logged_at
+"""
+
+# Summary per period; {period} is the generated month or year column
+SUMMARY_SQL = """
+    SELECT
+        {period},
+        COUNT(*) as project_count,
+        SUM(value) as total_value,
+        SUM(planned_days) as total_planned_days
+    FROM projects
+    GROUP BY {period}
+    ORDER BY {period} DESC
+"""
+
+WORKED_DAYS_SQL = """
+    SELECT partner, COUNT(*) FROM worklog
+    WHERE project_id = ? AND present = 1 AND partner IN ({placeholders})
+    GROUP BY partner
+"""
+
+
+@st.cache_resource
 def init_db():
-    """Inicjalizacja bazy danych z wymaganymi tabelami."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    """Inicjalizacja bazy danych z wymaganymi tabelami (raz na proces)."""
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise RuntimeError(
+            f"SQLite {'.'.join(map(str, MIN_SQLITE_VERSION))}+ is required "
+            f"(generated columns), found {sqlite3.sqlite_version}"
+        )
     
+    conn = get_db_connection()
+    with get_write_lock():
+        user_version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if user_version < SCHEMA_VERSION:
+            _create_schema(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            # New indexes need statistics; an empty database is analyzed later
+            # by optimize_db_if_due once it has data
+            _analyze_once(conn, force=True)
+        _sync_scenarios(conn)
+
+
+def _sync_scenarios(conn: sqlite3.Connection):
+    """Uzgodnij tabelę scenarios ze słownikiem SCENARIOS (jedynym źródłem udziałów)."""
+    rows = [(name, partner, share) for name, shares in SCENARIOS.items() for partner, share in shares.items()]
+    wanted = {(name, partner) for name, partner, _ in rows}
+    
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany("""
+            INSERT INTO scenarios (name, partner, share) VALUES (?, ?, ?)
+            ON CONFLICT(name, partner) DO UPDATE SET share = excluded.share
+            WHERE share != excluded.share
+        """, rows)
+        stale = [key for key in conn.execute("SELECT name, partner FROM scenarios") if tuple(key) not in wanted]
+        conn.executemany("DELETE FROM scenarios WHERE name = ? AND partner = ?", stale)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _analyze_once(conn: sqlite3.Connection, force: bool = False):
+    """Zbierz statystyki planera (ANALYZE) przy pierwszym uruchomieniu z danymi lub po migracji."""
+    has_stats = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    ).fetchone()
+    if has_stats and not force:
+        return
+    
+    has_data = conn.execute("SELECT EXISTS (SELECT 1 FROM projects)").fetchone()[0]
+    if has_data:
+        conn.execute("ANALYZE")
+
+
+@st.cache_resource
+def _maintenance_state() -> Dict[str, float]:
+    """Czas ostatniego PRAGMA optimize, współdzielony przez wszystkie sesje."""
+    return {"last_optimize": 0.0}
+
+
+def optimize_db_if_due():
+    """Uruchom ANALYZE (gdy brak statystyk) i PRAGMA optimize co OPTIMIZE_INTERVAL_SECONDS."""
+    state = _maintenance_state()
+    now = time.monotonic()
+    if state["last_optimize"] and now - state["last_optimize"] < OPTIMIZE_INTERVAL_SECONDS:
+        return
+    
+    state["last_optimize"] = now
+    with get_write_lock():
+        conn = get_db_connection()
+        _analyze_once(conn)
+        conn.execute("PRAGMA optimize")
+
+
+def _create_schema(conn: sqlite3.Connection):
+    """Utwórz tabele, jeśli jeszcze nie istnieją."""
+    cursor = conn.cursor()
+
     # Create projects table
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS projects (
@@ -67,81 +199,181 @@ def init_db():
         )
     """)
     
-    conn.commit()
-    conn.close()
+    # Month/year derived from the ISO date, so summaries group on an indexed column
+    project_columns = {row[1] for row in cursor.execute("PRAGMA table_xinfo(projects)")}
+    if "month" not in project_columns:
+        cursor.execute("ALTER TABLE projects ADD COLUMN month TEXT GENERATED ALWAYS AS (substr(date, 1, 7)) VIRTUAL")
+    if "year" not in project_columns:
+        cursor.execute("ALTER TABLE projects ADD COLUMN year TEXT GENERATED ALWAYS AS (substr(date, 1, 4)) VIRTUAL")
+    
+    # Create scenarios table (mirror of SCENARIOS, read by the payout query)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scenarios (
+            name TEXT NOT NULL,
+            partner TEXT NOT NULL,
+            share REAL NOT NULL,
+            PRIMARY KEY (name, partner)
+        )
+    """)
+    
+    # Indexes for worked-day counts, date summaries and the worklog export.
+    # present comes before partner so "present = 1 ... GROUP BY partner" is a
+    # single covering range scan; it supersedes the older (project_id, partner, present)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_worklog_proj_present
+        ON worklog(project_id, present, partner)
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_worklog_proj_partner_present")
+    # Cover the monthly/yearly GROUP BY scans without table lookups
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_projects_month
+        ON projects(month, value, planned_days)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_projects_year
+        ON projects(year, value, planned_days)
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_projects_date_value")
+    cursor.execute("DROP INDEX IF EXISTS idx_projects_date")
+    # Serves the project worklog ORDER BY date DESC, partner without a sort step
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_worklog_proj_date
+        ON worklog(project_id, date DESC, partner)
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_worklog_logged_at ON worklog(logged_at DESC)")
+    # Covering index for the projects export: rows come out in created_at order
+    # straight from the index (id is the rowid and is stored implicitly)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_projects_created
+        ON projects(created_at DESC, name, date, scenario, value, planned_days)
+    """)
+
+
+def _configure_connection(conn: sqlite3.Connection, read_only: bool = False):
+    """Ustaw pragmy wydajnościowe dla połączenia."""
+    if not read_only:
+        # WAL lets readers run concurrently with a writer; journal_mode is persisted
+        # in the database header, the remaining pragmas apply to this connection
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    # 64 MB page cache, kept warm across reruns by the cached connections
+    conn.execute("PRAGMA cache_size=-64000")
+
+
+@st.cache_resource
+def get_db_connection() -> sqlite3.Connection:
+    """Get the shared read/write database connection (one per server process)."""
+    # Autocommit mode: transactions are opened explicitly by write_transaction()
+    conn = sqlite3.connect(
+        DB_FILE,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=CACHED_STATEMENTS
+    )
+    _configure_connection(conn)
+    return conn
+
 
+@st.cache_resource
+def get_read_connection() -> sqlite3.Connection:
+    """Get the shared read-only database connection used by queries."""
+    # Make sure the database file exists before opening it read-only
+    get_db_connection()
+    conn = sqlite3.connect(
+        f"file:{DB_FILE}?mode=ro",
+        uri=True,
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS
+    )
+    conn.row_factory = sqlite3.Row
+    _configure_connection(conn, read_only=True)
+    return conn
 
-def get_db_connection():
-    """Get a database connection."""
-    return sqlite3.connect(DB_FILE)
+
+@st.cache_resource
+def get_write_lock() -> threading.Lock:
+    """Blokada serializująca zapisy na współdzielonym połączeniu."""
+    return threading.Lock()
+
+
+@contextmanager
+def write_transaction() -> Iterator[sqlite3.Connection]:
+    """Wykonaj zapisy w jednej jawnej transakcji i unieważnij cache po zatwierdzeniu."""
+    conn = get_db_connection()
+    with get_write_lock():
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        _bump_db_version()
+
+
+@st.cache_resource
+def _db_version_state() -> Dict[str, int]:
+    """Licznik zmian w bazie współdzielony przez wszystkie sesje."""
+    return {"version": 0}
+
+
+def get_db_version() -> int:
+    """Pobierz aktualny numer wersji danych (klucz unieważniania cache)."""
+    return _db_version_state()["version"]
+
+
+def _bump_db_version():
+    """Zwiększ numer wersji danych po każdej zmianie w bazie."""
+    _db_version_state()["version"] += 1
 
 
 def create_project(name: str, proj_date: str, scenario: str, value: float, planned_days: int) -> int:
     """Tworzenie nowego projektu i zwrócenie jego ID."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    created_at = datetime.now().isoformat()
-    cursor.execute("""
-        INSERT INTO projects (name, date, scenario, value, planned_days, created_at)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (name, proj_date, scenario, value, planned_days, created_at))
-    
-    project_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with write_transaction() as conn:
+        cursor = conn.execute(f"""
+            INSERT INTO projects (name, date, scenario, value, planned_days, created_at)
+            VALUES (?, ?, ?, ?, ?, {NOW_SQL})
+        """, (name, proj_date, scenario, value, planned_days))
+        project_id = cursor.lastrowid
     
     return project_id
 
 
 def update_project_days(project_id: int, planned_days: int):
     """Aktualizacja liczby planowanych dni projektu."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        UPDATE projects
-        SET planned_days = ?
-        WHERE id = ?
-    """, (planned_days, project_id))
-    
-    conn.commit()
-    conn.close()
+    with write_transaction() as conn:
+        conn.execute("""
+            UPDATE projects
+            SET planned_days = ?
+            WHERE id = ?
+        """, (planned_days, project_id))
 
 
 def update_project(project_id: int, name: str, proj_date: str, scenario: str, value: float, planned_days: int):
     """Aktualizacja pełnych danych projektu."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        UPDATE projects
-        SET name = ?, date = ?, scenario = ?, value = ?, planned_days = ?
-        WHERE id = ?
-    """, (name, proj_date, scenario, value, planned_days, project_id))
-    
-    conn.commit()
-    conn.close()
+    with write_transaction() as conn:
+        conn.execute("""
+            UPDATE projects
+            SET name = ?, date = ?, scenario = ?, value = ?, planned_days = ?
+            WHERE id = ?
+        """, (name, proj_date, scenario, value, planned_days, project_id))
 
 
 def delete_project(project_id: int):
     """Usunięcie projektu i powiązanych danych."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Delete worklog entries first (foreign key constraint)
-    cursor.execute("DELETE FROM worklog WHERE project_id = ?", (project_id,))
-    
-    # Delete the project
-    cursor.execute("DELETE FROM projects WHERE id = ?", (project_id,))
-    
-    conn.commit()
-    conn.close()
+    with write_transaction() as conn:
+        # Delete worklog entries first (foreign key constraint)
+        conn.execute("DELETE FROM worklog WHERE project_id = ?", (project_id,))
+        
+        # Delete the project
+        conn.execute("DELETE FROM projects WHERE id = ?", (project_id,))
 
 
-def get_all_projects() -> List[Tuple]:
+def get_all_projects() -> List[sqlite3.Row]:
     """Pobierz wszystkie projekty posortowane według daty utworzenia."""
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -151,14 +383,13 @@ def get_all_projects() -> List[Tuple]:
     """)
     
     projects = cursor.fetchall()
-    conn.close()
     
     return projects
 
 
-def get_project_by_id(project_id: int) -> Tuple:
+def get_project_by_id(project_id: int) -> Optional[sqlite3.Row]:
     """Pobierz konkretny projekt po ID."""
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -168,7 +399,6 @@ def get_project_by_id(project_id: int) -> Tuple:
     """, (project_id,))
     
     project = cursor.fetchone()
-    conn.close()
     
     return project
 
@@ -176,50 +406,38 @@ def get_project_by_id(project_id: int) -> Tuple:
 # User management functions
 def add_user(name: str, share_percentage: float = 0):
     """Dodaj nowego użytkownika/partnera."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    created_at = datetime.now().isoformat()
     try:
-        cursor.execute("""
-            INSERT INTO users (name, share_percentage, created_at)
-            VALUES (?, ?, ?)
-        """, (name, share_percentage, created_at))
-        conn.commit()
-        conn.close()
+        with write_transaction() as conn:
+            conn.execute(f"""
+                INSERT INTO users (name, share_percentage, created_at)
+                VALUES (?, ?, {NOW_SQL})
+            """, (name, share_percentage))
         return True
     except sqlite3.IntegrityError:
-        conn.close()
         return False
 
 
 def update_user(old_name: str, new_name: str, share_percentage: float):
     """Aktualizuj dane użytkownika/partnera."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute("""
-            UPDATE users
-            SET name = ?, share_percentage = ?
-            WHERE name = ?
-        """, (new_name, share_percentage, old_name))
-        conn.commit()
-        conn.close()
+        with write_transaction() as conn:
+            conn.execute("""
+                UPDATE users
+                SET name = ?, share_percentage = ?
+                WHERE name = ?
+            """, (new_name, share_percentage, old_name))
         return True
     except sqlite3.IntegrityError:
-        conn.close()
         return False
 
 
 def get_all_users() -> List[str]:
     """Pobierz wszystkich użytkowników."""
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     
     cursor.execute("SELECT name FROM users ORDER BY name")
     users = [row[0] for row in cursor.fetchall()]
-    conn.close()
     
     # If no users, return default partners
     if not users:
@@ -228,47 +446,44 @@ def get_all_users() -> List[str]:
     return users
 
 
-def get_all_users_with_shares() -> List[Tuple]:
+def get_all_users_with_shares() -> List[sqlite3.Row]:
     """Pobierz wszystkich użytkowników z ich udziałami."""
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     
     cursor.execute("SELECT name, share_percentage FROM users ORDER BY name")
     users = cursor.fetchall()
-    conn.close()
     
     return users
 
 
 def delete_user(name: str):
     """Usuń użytkownika."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("DELETE FROM users WHERE name = ?", (name,))
-    conn.commit()
-    conn.close()
+    with write_transaction() as conn:
+        conn.execute("DELETE FROM users WHERE name = ?", (name,))
 
 
 def log_attendance(project_id: int, log_date: str, partner: str, present: int):
     """Rejestrowanie obecności partnera w określonym dniu. Ostatni zapis nadpisuje poprzedni."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    logged_at = datetime.now().isoformat()
-    
-    cursor.execute("""
-        INSERT OR REPLACE INTO worklog (project_id, date, partner, present, logged_at)
-        VALUES (?, ?, ?, ?, ?)
-    """, (project_id, log_date, partner, present, logged_at))
-    
-    conn.commit()
-    conn.close()
+    log_attendance_bulk(project_id, log_date, [(partner, present)])
+
 
+def log_attendance_bulk(project_id: int, log_date: str, entries: List[Tuple[str, int]]):
+    """Rejestrowanie obecności wielu partnerów w jednej transakcji. Ostatni zapis nadpisuje poprzedni."""
+    rows = [
+        (project_id, log_date, partner, present)
+        for partner, present in entries
+    ]
+    if not rows:
+        return
+    
+    with write_transaction() as conn:
+        conn.executemany(UPSERT_WORKLOG_SQL, rows)
 
-def get_worklog_for_project(project_id: int) -> List[Tuple]:
+
+def get_worklog_for_project(project_id: int) -> List[sqlite3.Row]:
     """Pobierz wszystkie wpisy dziennika pracy dla projektu."""
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -279,35 +494,115 @@ def get_worklog_for_project(project_id: int) -> List[Tuple]:
     """, (project_id,))
     
     logs = cursor.fetchall()
-    conn.close()
     
     return logs
 
 
+def get_recent_worklog_for_project(project_id: int, limit: int = 10) -> List[sqlite3.Row]:
+    """Pobierz `limit` najnowszych wpisów projektu ze statusem gotowym do wyświetlenia."""
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        SELECT
+            date,
+            partner,
+            CASE present WHEN 1 THEN '✅ Obecny' ELSE '❌ Nieobecny' END as status
+        FROM worklog
+        WHERE project_id = ?
+        ORDER BY date DESC, partner
+        LIMIT ?
+    """, (project_id, limit))
+    
+    return cursor.fetchall()
+
+
 def get_worked_days_by_partner(project_id: int, partners: List[str]) -> Dict[str, int]:
     """Pobierz całkowitą liczbę przepracowanych dni (obecność=1) dla każdego partnera w projekcie."""
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     
     worked_days = {partner: 0 for partner in partners}
+    if not partners:
+        return worked_days
     
-    for partner in partners:
-        cursor.execute("""
-            SELECT COUNT(*) FROM worklog
-            WHERE project_id = ? AND partner = ? AND present = 1
-        """, (project_id, partner))
-        
-        count = cursor.fetchone()[0]
-        worked_days[partner] = count
+    placeholders = ", ".join("?" for _ in partners)
+    cursor.execute(WORKED_DAYS_SQL.format(placeholders=placeholders), (project_id, *partners))
     
-    conn.close()
+    for partner, count in cursor.fetchall():
+        worked_days[partner] = count
     
     return worked_days
 
 
+def get_payout_inputs(project_id: int, partners: List[str]) -> Tuple[Optional[Dict], Dict[str, int], Dict[str, float]]:
+    """Pobierz projekt, przepracowane dni i udziały partnerów jednym zapytaniem.
+    
+    Zwraca projekt jako None, jeśli nie istnieje. Udziały pochodzą z tabeli
+    users, a gdy nie zdefiniowano żadnych użytkowników - ze scenariusza projektu.
+    """
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    
+    if partners:
+        partner_list = "VALUES " + ", ".join("(?)" for _ in partners)
+    else:
+        partner_list = "SELECT NULL WHERE 0"
+    
+    cursor.execute(f"""
+        WITH partner_list(name) AS ({partner_list}),
+        worked AS (
+            SELECT partner, COUNT(*) AS days
+            FROM worklog
+            WHERE project_id = ? AND present = 1
+            GROUP BY partner
+        )
+        SELECT
+            p.name AS project_name,
+            p.scenario,
+            p.value,
+            p.planned_days,
+            pl.name AS partner,
+            CASE WHEN EXISTS (SELECT 1 FROM users)
+                THEN u.share_percentage ELSE s.share END AS share,
+            COALESCE(w.days, 0) AS days
+        FROM projects p
+        LEFT JOIN partner_list pl
+        LEFT JOIN users u ON u.name = pl.name
+        LEFT JOIN scenarios s ON s.name = p.scenario AND s.partner = pl.name
+        LEFT JOIN worked w ON w.partner = pl.name
+        WHERE p.id = ?
+    """, (*partners, project_id, project_id))
+    rows = cursor.fetchall()
+    
+    if not rows:
+        return None, {}, {}
+    
+    first = rows[0]
+    project = {
+        "name": first["project_name"],
+        "scenario": first["scenario"],
+        "value": first["value"],
+        "planned_days": first["planned_days"],
+    }
+    
+    worked_days = {}
+    partner_shares = {}
+    for row in rows:
+        if row["partner"] is None:
+            continue
+        worked_days[row["partner"]] = row["days"]
+        partner_shares[row["partner"]] = float(row["share"] or 0)
+    
+    return project, worked_days, partner_shares
+
+
 def calculate_payouts(project_id: int, partners: List[str]) -> Dict[str, any]:
     """Obliczanie wypłat dla projektu na podstawie przepracowanych dni."""
-    project = get_project_by_id(project_id)
+    import numpy as np
+    
+    # Project, worked days and partner shares (users or scenario) come back from a single query
+    project, worked_days, partner_shares = get_payout_inputs(project_id, partners)
     if not project:
         return {
             "error": "Nie znaleziono projektu",
@@ -323,53 +618,39 @@ def calculate_payouts(project_id: int, partners: List[str]) -> Dict[str, any]:
             "over_plan": False
         }
     
-    _, name, proj_date, scenario, total_value, planned_days, _ = project
+    name = project["name"]
+    total_value = project["value"]
+    planned_days = project["planned_days"]
     
-    # Get worked days for each partner
-    worked_days = get_worked_days_by_partner(project_id, partners)
+    # Calculate firm cut
+    firm_cut = total_value * FIRM_FRAC
+    distributable = total_value - firm_cut
     
-    # Get partner shares from database (or use scenario as fallback)
-    users_with_shares = get_all_users_with_shares()
-    partner_shares = {}
+    # Only partners with a positive share take part in the payout
+    paid_partners = [p for p in partners if partner_shares.get(p, 0) > 0]
+    share_values = [partner_shares[p] for p in paid_partners]
+    days = np.fromiter((worked_days.get(p, 0) for p in paid_partners), dtype=np.int64, count=len(paid_partners))
     
-    if users_with_shares:
-        # Use dynamic shares from database
-        for user_name, user_share in users_with_shares:
-            partner_shares[user_name] = float(user_share)
+    # Payout formula: share% * distributable / planned_days * worked_days
+    if planned_days > 0:
+        shares = np.fromiter((partner_shares[p] / 100 for p in paid_partners), dtype=np.float64, count=len(paid_partners))
+        payout_values = (shares * (distributable / planned_days) * days).tolist()
     else:
-        # Fallback to scenario shares if no users defined
-        shares = SCENARIOS.get(scenario, {})
-        partner_shares = shares
-    
-    # Calculate firm cut
-    firm_cut = total_value * (FIRM_PERCENTAGE / 100)
-    distributable = total_value - firm_cut
+        payout_values = [0] * len(paid_partners)
     
-    # Calculate payouts
-    payouts = {}
-    for partner in partners:
-        # Get partner's share percentage
-        share_pct_value = partner_shares.get(partner, 0)
-        
-        if share_pct_value > 0:
-            share_pct = share_pct_value / 100
-            days_worked = worked_days.get(partner, 0)
-            
-            # Payout formula: share% * distributable / planned_days * worked_days
-            if planned_days > 0:
-                per_day_value = distributable / planned_days
-                partner_per_day = share_pct * per_day_value
-                payout = partner_per_day * days_worked
-            else:
-                payout = 0
-            
-            payouts[partner] = {
-                "share_pct": share_pct_value,
-                "worked_days": days_worked,
-                "payout": payout
-            }
+    payouts = {
+        partner: {
+            "share_pct": share_pct_value,
+            "worked_days": days_worked,
+            "payout": payout
+        }
+        for partner, share_pct_value, days_worked, payout in zip(
+            paid_partners, share_values, days.tolist(), payout_values
+        )
+    }
     
-    total_paid = sum(p["payout"] for p in payouts.values())
+    # fsum avoids accumulating rounding error across partners
+    total_paid = fsum(payout_values)
     remaining = distributable - total_paid
     total_worked = sum(worked_days.values())
     
@@ -387,61 +668,65 @@ def calculate_payouts(project_id: int, partners: List[str]) -> Dict[str, any]:
     }
 
 
+def get_summaries() -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Pobierz miesięczne i roczne podsumowanie projektów."""
+    return _summary_for_period("month"), _summary_for_period("year")
+
+
+def _summary_for_period(period: str) -> pd.DataFrame:
+    """Podsumowanie projektów dla jednego okresu ("month" lub "year"), od najnowszego."""
+    import pandas as pd
+    
+    conn = get_read_connection()
+    cursor = conn.execute(SUMMARY_SQL.format(period=period))
+    columns = [column[0] for column in cursor.description]
+    return pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+
+
 def get_monthly_summary() -> pd.DataFrame:
     """Pobierz miesięczne podsumowanie projektów."""
-    conn = get_db_connection()
-    
-    query = """
-        SELECT 
-            strftime('%Y-%m', date) as month,
-            COUNT(*) as project_count,
-            SUM(value) as total_value,
-            SUM(planned_days) as total_planned_days
-        FROM projects
-        GROUP BY strftime('%Y-%m', date)
-        ORDER BY month DESC
-    """
-    
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    
-    return df
+    return _summary_for_period("month")
 
 
 def get_yearly_summary() -> pd.DataFrame:
     """Pobierz roczne podsumowanie projektów."""
-    conn = get_db_connection()
-    
-    query = """
-        SELECT 
-            strftime('%Y', date) as year,
-            COUNT(*) as project_count,
-            SUM(value) as total_value,
-            SUM(planned_days) as total_planned_days
-        FROM projects
-        GROUP BY strftime('%Y', date)
-        ORDER BY year DESC
-    """
-    
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    
-    return df
+    return _summary_for_period("year")
+
+
+def _query_to_csv(query: str) -> str:
+    """Zapisz wynik zapytania do CSV wiersz po wierszu, bez pośredniego DataFrame."""
+    conn = get_read_connection()
+    cursor = conn.execute(query)
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow([column[0] for column in cursor.description])
+    while batch := cursor.fetchmany(CSV_BATCH_SIZE):
+        writer.writerows(batch)
+    
+    return buffer.getvalue()
 
 
 def export_projects_csv() -> str:
     """Eksport wszystkich projektów do formatu CSV."""
-    conn = get_db_connection()
-    df = pd.read_sql_query("SELECT * FROM projects ORDER BY created_at DESC", conn)
-    conn.close()
+    query = """
+        SELECT
+            id,
+            name,
+            date,
+            scenario,
+            printf('%.2f', value) as value,
+            planned_days,
+            created_at
+        FROM projects
+        ORDER BY created_at DESC
+    """
     
-    return df.to_csv(index=False)
+    return _query_to_csv(query)
 
 
 def export_worklog_csv() -> str:
     """Eksport dziennika pracy ze szczegółami projektu do formatu CSV."""
-    conn = get_db_connection()
-    
     query = """
         SELECT 
             w.id,
@@ -450,17 +735,77 @@ def export_worklog_csv() -> str:
             strftime('%Y-%m', p.date) as project_month,
             w.date,
             w.partner,
-            w.present,
+            CASE w.present WHEN 1 THEN 'Obecny' ELSE 'Nieobecny' END as status,
             w.logged_at
         FROM worklog w
         JOIN projects p ON w.project_id = p.id
         ORDER BY w.logged_at DESC
     """
     
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    return _query_to_csv(query)
+
+
+# Cached readers, invalidated whenever get_db_version() changes. Keys from
+# older versions are never requested again, so max_entries bounds what they hold
+# (a few projects' worth for per-project readers)
+@st.cache_data(show_spinner=False, max_entries=2)
+def get_project_options_cached(db_version: int) -> Tuple[Dict[str, int], Dict[int, int]]:
+    """Opcje listy wyboru projektów (etykieta -> ID) oraz pozycja każdego ID na liście."""
+    project_options = {f"{p['name']} ({p['date']})": p["id"] for p in get_all_projects()}
+    id_to_index = {project_id: i for i, project_id in enumerate(project_options.values())}
+    return project_options, id_to_index
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def get_project_by_id_cached(project_id: int, db_version: int) -> Optional[Dict]:
+    """Projekt po ID buforowany do następnej zmiany w bazie."""
+    project = get_project_by_id(project_id)
+    return dict(project) if project else None
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def get_all_users_cached(db_version: int) -> List[str]:
+    """Lista użytkowników buforowana do następnej zmiany w bazie."""
+    return get_all_users()
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def get_all_users_with_shares_cached(db_version: int) -> List[Dict]:
+    """Użytkownicy z udziałami buforowani do następnej zmiany w bazie."""
+    return [dict(row) for row in get_all_users_with_shares()]
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def calculate_payouts_cached(project_id: int, partners: List[str], db_version: int) -> Dict[str, any]:
+    """Wypłaty projektu buforowane do następnej zmiany w bazie."""
+    return calculate_payouts(project_id, partners)
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def get_summaries_cached(db_version: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Podsumowania miesięczne i roczne buforowane do następnej zmiany w bazie."""
+    return get_summaries()
+
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def export_projects_csv_cached(db_version: int) -> str:
+    """CSV projektów buforowany do następnej zmiany w bazie."""
+    return export_projects_csv()
+
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def export_worklog_csv_cached(db_version: int) -> str:
+    """CSV dziennika pracy buforowany do następnej zmiany w bazie."""
+    return export_worklog_csv()
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def get_recent_log_df_cached(project_id: int, db_version: int) -> pd.DataFrame:
+    """Ostatnie wpisy obecności projektu gotowe do wyświetlenia."""
+    import pandas as pd
     
-    return df.to_csv(index=False)
+    logs = get_recent_worklog_for_project(project_id, limit=10)
+    return pd.DataFrame.from_records(logs, columns=["Data", "Partner", "Status"])
 
 
 def main():
@@ -468,6 +813,7 @@ def main():
     
     # Initialize database
     init_db()
+    optimize_db_if_due()
     
     # Initialize session state
     if "current_project_id" not in st.session_state:
@@ -476,7 +822,8 @@ def main():
     st.title("💰 System Rozliczeń Projektów i Śledzenia Czasu")
     
     # Get current users list
-    partners = get_all_users()
+    db_version = get_db_version()
+    partners = get_all_users_cached(db_version)
     
     # Create tabs for main sections
     tab_projects, tab_users = st.tabs(["Projekty", "Zarządzanie Użytkownikami"])
@@ -505,9 +852,10 @@ def main():
         
         with col2:
             st.subheader("Aktualni partnerzy")
-            users_with_shares = get_all_users_with_shares()
+            users_with_shares = get_all_users_with_shares_cached(db_version)
             if users_with_shares:
-                for user_name, user_share in users_with_shares:
+                for user in users_with_shares:
+                    user_name, user_share = user["name"], user["share_percentage"]
                     with st.expander(f"👤 {user_name} ({user_share}%)"):
                         with st.form(f"edit_user_{user_name}"):
                             edited_name = st.text_input("Nazwa", value=user_name, key=f"name_{user_name}")
@@ -547,9 +895,8 @@ def main():
                     scenario = st.selectbox("Scenariusz", options=list(SCENARIOS.keys()))
                     
                     # Show scenario details
-                    st.caption(f"**{scenario} - Podział:**")
-                    for partner, share in SCENARIOS[scenario].items():
-                        st.caption(f"  {partner}: {share}%")
+                    shares_summary = ", ".join(f"{partner}: {share}%" for partner, share in SCENARIOS[scenario].items())
+                    st.caption(f"**{scenario} - Podział:** {shares_summary}")
                     
                     proj_value = st.number_input(f"Wartość Całkowita ({CURRENCY})", min_value=0.0, value=1000.0, step=100.0)
                     planned_days = st.number_input("Planowane Dni", min_value=1, value=10, step=1)
@@ -573,17 +920,13 @@ def main():
             
             # Select existing project
             st.subheader("📋 Ostatnie Projekty")
-            projects = get_all_projects()
+            project_options, project_index = get_project_options_cached(db_version)
             
-            if projects:
-                project_options = {f"{p[1]} ({p[2]})": p[0] for p in projects}
-                
+            if project_options:
                 selected_project_label = st.selectbox(
                     "Wybierz Projekt",
                     options=list(project_options.keys()),
-                    index=0 if st.session_state.current_project_id is None else 
-                          list(project_options.values()).index(st.session_state.current_project_id) 
-                          if st.session_state.current_project_id in project_options.values() else 0
+                    index=project_index.get(st.session_state.current_project_id, 0)
                 )
                 
                 if st.button("Wczytaj Wybrany Projekt"):
@@ -594,10 +937,14 @@ def main():
     
         # Main content area
         if st.session_state.current_project_id:
-            project = get_project_by_id(st.session_state.current_project_id)
+            project = get_project_by_id_cached(st.session_state.current_project_id, db_version)
             
             if project:
-                _, proj_name, proj_date, scenario, value, planned_days, _ = project
+                proj_name = project["name"]
+                proj_date = project["date"]
+                scenario = project["scenario"]
+                value = project["value"]
+                planned_days = project["planned_days"]
                 
                 st.header(f"📊 Aktualny Projekt: {proj_name}")
                 
@@ -669,24 +1016,19 @@ def main():
                         log_submitted = st.form_submit_button("💾 Zapisz Obecność")
                         
                         if log_submitted:
-                            for partner, present in attendance.items():
-                                log_attendance(
-                                    st.session_state.current_project_id,
-                                    log_date.isoformat(),
-                                    partner,
-                                    1 if present else 0
-                                )
+                            log_attendance_bulk(
+                                st.session_state.current_project_id,
+                                log_date.isoformat(),
+                                [(partner, 1 if present else 0) for partner, present in attendance.items()]
+                            )
                             st.success(f"✅ Zapisano obecność dla {log_date}")
                             st.rerun()
                 
                 with col_right:
                     st.write("**Ostatnie Wpisy Obecności:**")
-                    logs = get_worklog_for_project(st.session_state.current_project_id)
+                    display_df = get_recent_log_df_cached(st.session_state.current_project_id, db_version)
                     
-                    if logs:
-                        log_df = pd.DataFrame(logs, columns=["ID", "ID Projektu", "Data", "Partner", "Obecny", "Zapisano"])
-                        log_df["Status"] = log_df["Obecny"].apply(lambda x: "✅ Obecny" if x == 1 else "❌ Nieobecny")
-                        display_df = log_df[["Data", "Partner", "Status"]].head(10)
+                    if not display_df.empty:
                         st.dataframe(display_df, hide_index=True, width='stretch')
                     else:
                         st.info("Brak wpisów obecności")
@@ -696,7 +1038,7 @@ def main():
                 # Payout Calculation
                 st.subheader("💵 Obliczanie Wypłat")
                 
-                payout_data = calculate_payouts(st.session_state.current_project_id, partners)
+                payout_data = calculate_payouts_cached(st.session_state.current_project_id, partners, db_version)
                 
                 if payout_data:
                     col1, col2, col3, col4 = st.columns(4)
@@ -714,19 +1056,22 @@ def main():
                     
                     # Payout table
                     st.write("**Wypłaty dla Partnerów:**")
-                    payout_rows = []
-                    for partner in partners:
-                        if partner in payout_data['payouts']:
-                            p_data = payout_data['payouts'][partner]
-                            payout_rows.append({
-                                "Partner": partner,
-                                "Udział %": f"{p_data['share_pct']:.2f}%",
-                                "Przepracowane Dni": p_data['worked_days'],
-                                "Wypłata": f"{p_data['payout']:,.2f} {CURRENCY}"
-                            })
+                    import pandas as pd
                     
-                    payout_df = pd.DataFrame(payout_rows)
-                    st.dataframe(payout_df, hide_index=True, width='stretch')
+                    # Payouts are already ordered like partners; build the table column-wise
+                    # and leave the numbers numeric, formatting them only for display
+                    payouts = payout_data['payouts']
+                    payout_df = pd.DataFrame({
+                        "Partner": list(payouts),
+                        "Udział %": [p['share_pct'] for p in payouts.values()],
+                        "Przepracowane Dni": [p['worked_days'] for p in payouts.values()],
+                        "Wypłata": [p['payout'] for p in payouts.values()],
+                    })
+                    payout_styler = payout_df.style.format({
+                        "Udział %": "{:.2f}%",
+                        "Wypłata": f"{{:,.2f}} {CURRENCY}",
+                    })
+                    st.dataframe(payout_styler, hide_index=True, width='stretch')
         else:
             st.info("👈 Proszę utworzyć lub wybrać projekt z paska bocznego, aby rozpocząć!")
         
@@ -736,10 +1081,10 @@ def main():
         st.header("📈 Podsumowania i Raporty")
         
         tab1, tab2, tab3 = st.tabs(["Podsumowanie Miesięczne", "Podsumowanie Roczne", "Eksport Danych"])
+        monthly_df, yearly_df = get_summaries_cached(db_version)
         
         with tab1:
             st.subheader("Podsumowanie Miesięczne")
-            monthly_df = get_monthly_summary()
             if not monthly_df.empty:
                 # Rename columns to Polish
                 monthly_df.columns = ['Miesiąc', 'Liczba Projektów', f'Całkowita Wartość ({CURRENCY})', 'Całkowite Planowane Dni']
@@ -749,7 +1094,6 @@ def main():
         
         with tab2:
             st.subheader("Podsumowanie Roczne")
-            yearly_df = get_yearly_summary()
             if not yearly_df.empty:
                 # Rename columns to Polish
                 yearly_df.columns = ['Rok', 'Liczba Projektów', f'Całkowita Wartość ({CURRENCY})', 'Całkowite Planowane Dni']
@@ -764,20 +1108,19 @@ def main():
             
             with col1:
                 st.write("**Dane Projektów**")
-                projects_csv = export_projects_csv()
+                # Built only when the button is clicked (and then cached per data version)
                 st.download_button(
                     label="📥 Pobierz CSV Projektów",
-                    data=projects_csv,
+                    data=partial(export_projects_csv_cached, db_version),
                     file_name=f"projekty_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                     mime="text/csv"
                 )
             
             with col2:
                 st.write("**Dane Dziennika Pracy**")
-                worklog_csv = export_worklog_csv()
                 st.download_button(
                     label="📥 Pobierz CSV Dziennika",
-                    data=worklog_csv,
+                    data=partial(export_worklog_csv_cached, db_version),
                     file_name=f"dziennik_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                     mime="text/csv"
                 )